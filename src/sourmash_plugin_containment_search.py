@@ -20,15 +20,22 @@ import argparse
 import sourmash
 import numpy as np
 import shutil
-import csv
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 
 from sourmash import sourmash_args
-from sourmash.search import PrefetchResult
 from sourmash.cli.utils import (add_ksize_arg, add_moltype_args,
                                 add_scaled_arg)
 from sourmash.plugins import CommandLinePlugin
 from sourmash.logging import notify, error
 
+# numba is optional; if available, use it to compile the intersection kernel.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 ###
 
 def _get_screen_width():
@@ -112,6 +119,8 @@ class Command_ContainmentManySearch(CommandLinePlugin):
         subparser.add_argument('--ani', dest='detection',
                                action="store_false",
                                help="output estimated ANI, instead of fraction of query detected; see --detection")
+        subparser.add_argument('-c', '--cores', type=int, default=1,
+                               help='number of metagenomes to search in parallel (default: 1)')
 
         add_ksize_arg(subparser, default=31)
         add_moltype_args(subparser)
@@ -129,7 +138,8 @@ class Command_ContainmentManySearch(CommandLinePlugin):
                               scaled=args.scaled,
                               output=args.output,
                               require_abundance=args.require_abundance,
-                              output_ani=not args.detection)
+                              output_ani=not args.detection,
+                              cores=args.cores)
 
 
 ## Implementation!
@@ -162,6 +172,44 @@ COLUMNS = ['intersect_bp',
            'potential_false_negative'
            ]
 
+# all result columns, plus the display name; filled in for each result.
+_RESULTS_TEMPLATE = dict.fromkeys(COLUMNS + ['display_name'])
+
+
+def _csv_field(value):
+    """
+    Format a single CSV field the way csv.writer does by default: None is
+    empty, and strings are only quoted if they need to be.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str) and \
+       (',' in value or '"' in value or '\n' in value or '\r' in value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+class _ResultsWriter:
+    """
+    Write search results to a CSV file, with a large buffer.
+
+    Rows are formatted with a precompiled format string rather than the
+    csv module; output is the same as csv.writer's.
+    """
+    buffer_size = 1 << 20
+    row_fmt = ",".join(["{}"] * len(COLUMNS)) + "\r\n"
+
+    def __init__(self, filename):
+        self.fp = open(filename, 'w', newline='', buffering=self.buffer_size)
+        self.fp.write(self.row_fmt.format(*COLUMNS))
+
+    def writerow(self, results_d):
+        values = [ _csv_field(results_d[col]) for col in COLUMNS ]
+        self.fp.write(self.row_fmt.format(*values))
+
+    def close(self):
+        self.fp.close()
+
 
 def mgsearch(query_filename, against_list, *,
              ksize=31, moltype='DNA', scaled=1000, output=None,
@@ -185,28 +233,18 @@ def mgsearch(query_filename, against_list, *,
     query_ss = query_ss[0]
     print(f"Loaded query signature: {query_ss._display_name(screen_width - 25)}")
 
-    query_mh = query_ss.minhash
-    if query_mh.track_abundance:
-        notify(f"WARNING: query sketch '{query_ss.name}' has abundance; ignoring.")
-        query_mh = query_mh.flatten()
-        query_ss = query_ss.to_mutable()
-        query_ss.minhash = query_mh
+    try:
+        query_info = _get_query_info(query_ss, scaled=scaled)
+    except ValueError:
+        notify(f"ERROR: cannot downsample query '{query_ss.name}' to {scaled}")
+        return -1
 
-    if scaled and query_mh.scaled != scaled:
-        try:
-            query_mh = query_mh.downsample(scaled=scaled)
-        except ValueError:
-            notify(f"ERROR: cannot downsample query '{query_ss.name}' to {scaled}")
-            return -1
-        query_ss = query_ss.to_mutable()
-        query_ss.minhash = query_mh
+    # ANI is only needed for CSV output, or for display w/--ani
+    want_ani = bool(output) or output_ani
 
     if output:
-        out_fp = open(output, 'w', newline='')
-        out_w = csv.DictWriter(out_fp, fieldnames=COLUMNS)
-        out_w.writeheader()
+        out_w = _ResultsWriter(output)
     else:
-        out_fp = None
         out_w = None
 
     # go through metagenomes one by one
@@ -217,63 +255,69 @@ def mgsearch(query_filename, against_list, *,
     # missing abundances?
     missed_abundance = False
     
-    for metag_filename in against_list:
-        try:
-            results_d = _search_metag(query_ss, metag_filename,
-                                      ksize=ksize, scaled=scaled,
-                                      require_abundance=require_abundance,
-                                      screen_width=screen_width,
-                                      field_width=41)
-            results_d = list(results_d)[0]
-        except MismatchScaled:
-            error(f"Unable to run comparison for '{query_ss.name}'; maybe set --scaled?")
-            return -1
+    # load the next metagenome in the background while searching this one
+    load_fn = partial(_load_metag, ksize=ksize, scaled=scaled,
+                      require_abundance=require_abundance,
+                      display_width=screen_width - 41, first_only=True)
+
+    try:
+        for metag_ctxs in _map_prefetch(load_fn, against_list):
+            # as always, report only the first sketch in each file.
+            metag_ctx = metag_ctxs[0]
+            try:
+                results_d = _score_query_against_metag(query_info, metag_ctx,
+                                                       want_ani=want_ani)
+            except MismatchScaled:
+                error(f"Unable to run comparison for '{query_ss.name}'; maybe set --scaled?")
+                return -1
 
-        name = results_d['display_name']
-        del results_d['display_name']
+            name = results_d['display_name']
+            del results_d['display_name']
 
-        has_abundance = results_d['average_abund'] != ''
+            has_abundance = metag_ctx['has_abundance']
+            if not has_abundance:
+                missed_abundance = True
 
-        # write out CSV
-        if out_w:
-            out_w.writerow(results_d)
+            # write out CSV
+            if out_w:
+                out_w.writerow(results_d)
+
+            # displaying first result?
+            if first:
+                print("")
+                if output_ani:
+                    print("  ANI    avg_abund   p_metag   metagenome name")
+                    print("-------- ---------   -------   ---------------")
+                else:
+                    print("p_genome avg_abund   p_metag   metagenome name")
+                    print("-------- ---------   -------   ---------------")
+                first = False
 
-        # displaying first result?
-        if first:
-            print("")
             if output_ani:
-                print("  ANI    avg_abund   p_metag   metagenome name")
-                print("-------- ---------   -------   ---------------")
+                ani = results_d['genome_containment_ani']
+                display_ani = f"{ani*100:.1f}"
             else:
-                print("p_genome avg_abund   p_metag   metagenome name")
-                print("-------- ---------   -------   ---------------")
-            first = False
+                f_genome_found = results_d['f_query']
+                pct_genome = f"{f_genome_found*100:.1f}"
 
-        if output_ani:
-            ani = results_d['genome_containment_ani']
-            display_ani = f"{ani*100:.1f}"
-        else:
-            f_genome_found = results_d['f_query']
-            pct_genome = f"{f_genome_found*100:.1f}"
+            if has_abundance:
+                f_metag_weighted = results_d['f_match_weighted']
+                pct_metag = f"{f_metag_weighted*100:.1f}%"
 
-        if has_abundance:
-            f_metag_weighted = results_d['f_match_weighted']
-            pct_metag = f"{f_metag_weighted*100:.1f}%"
-
-            avg_abund = results_d['average_abund']
-            avg_abund = f"{avg_abund:.1f}"
-        else:
-            avg_abund = "N/A"
-            pct_metag = "N/A"
-
-        if output_ani:
-            print(f'{display_ani:>6}%  {avg_abund:>6}     {pct_metag:>6}     {name}')
-        else:
-            print(f'{pct_genome:>6}%  {avg_abund:>6}     {pct_metag:>6}     {name}')
+                avg_abund = results_d['average_abund']
+                avg_abund = f"{avg_abund:.1f}"
+            else:
+                avg_abund = "N/A"
+                pct_metag = "N/A"
 
-    # close CSV file
-    if out_fp:
-        out_fp.close()
+            if output_ani:
+                print(f'{display_ani:>6}%  {avg_abund:>6}     {pct_metag:>6}     {name}')
+            else:
+                print(f'{pct_genome:>6}%  {avg_abund:>6}     {pct_metag:>6}     {name}')
+    finally:
+        # close CSV file, even on error
+        if out_w:
+            out_w.close()
 
     # notify user that there were columns that were not filled in
     if missed_abundance:
@@ -283,10 +327,10 @@ def mgsearch(query_filename, against_list, *,
 
 def mg_many_search(query_filenames, against_list, *,
                    ksize=31, moltype='DNA', scaled=1000, output=None,
-                   require_abundance=False, output_ani=False):
+                   require_abundance=False, output_ani=False, cores=1):
     """
     Search multiple genomes in many metagenomes, loading each metagenome
-    once.
+    once. With cores > 1, metagenomes are searched in parallel processes.
     """
     screen_width = _get_screen_width()
 
@@ -302,39 +346,22 @@ def mg_many_search(query_filenames, against_list, *,
 
     print(f"Loaded {len(query_sigs)} query signatures.")
 
-    # flatten and downsample each query sig if necessary.
-    new_query_sigs = []
+    # flatten and downsample each query sketch if necessary, and calculate
+    # per-query info once, for reuse across all metagenomes.
+    query_infos = []
     for query_ss in query_sigs:
-        query_mh = query_ss.minhash
-
-        # replace with flattened query
-        if query_mh.track_abundance:
-            query_ss = query_ss.to_mutable()
-            notify(f"WARNING: query sketch '{query_ss.name}' has abundance; ignoring.")
-            query_mh = query_mh.flatten()
-            query_ss.minhash = query_mh
-
-        # replace with downsampled query
-        if scaled is not None and scaled != query_mh.scaled:
-            try:
-                query_mh = query_mh.downsample(scaled=scaled)
-            except ValueError:
-                notify(f"ERROR: cannot downsample query '{query_ss.name}' to {scaled}")
-                return -1
-            query_ss = query_ss.to_mutable()
-            query_ss.minhash = query_mh
-
-        new_query_sigs.append(query_ss)
+        try:
+            query_info = _get_query_info(query_ss, scaled=scaled)
+        except ValueError:
+            notify(f"ERROR: cannot downsample query '{query_ss.name}' to {scaled}")
+            return -1
 
-    query_sigs = new_query_sigs
+        query_infos.append(query_info)
 
     # prepare output
     if output:
-        out_fp = open(output, 'w', newline='')
-        out_w = csv.DictWriter(out_fp, fieldnames=COLUMNS)
-        out_w.writeheader()
+        out_w = _ResultsWriter(output)
     else:
-        out_fp = None
         out_w = None
 
     # display stuff
@@ -343,21 +370,69 @@ def mg_many_search(query_filenames, against_list, *,
     # came across missing abundances?
     missed_abundance = False
 
-    ### go through metagenomes one by one
-    for metag_filename in against_list:
-        # for each metagenome, iterate over query sigs
-        for query_ss in query_sigs:
-            try:
-                for results_d in _search_metag(query_ss, metag_filename,
-                                               ksize=ksize, scaled=scaled,
-                                               require_abundance=require_abundance,
-                                               screen_width=screen_width,
-                                               field_width=21):
+    # ANI is only needed for CSV output, or for display w/--ani
+    want_ani = bool(output) or output_ani
+
+    # identical query sketches (by md5sum) only need to be searched once;
+    # their results are copied out to each duplicate query below.
+    unique_infos = {}
+    for query_info in query_infos:
+        unique_infos.setdefault(query_info['md5'], query_info)
+    unique_md5s = list(unique_infos)
+    unique_infos = list(unique_infos.values())
+
+    if len(unique_infos) < len(query_infos):
+        notify(f"Searching with {len(unique_infos)} distinct query sketches.")
+
+    ### go through metagenomes one by one, or in parallel
+    executor = None
+    futures = []
+    if cores > 1:
+        # send the queries to each worker process once, rather than with
+        # every metagenome; scratch buffers are allocated in the worker.
+        worker_infos = [ { k: v for k, v in query_info.items()
+                           if k != 'abund_buf' }
+                         for query_info in unique_infos ]
+        search_kwargs = dict(ksize=ksize, scaled=scaled,
+                             require_abundance=require_abundance,
+                             display_width=screen_width - 21,
+                             want_ani=want_ani)
+        executor = ProcessPoolExecutor(max_workers=cores,
+                                       initializer=_init_worker,
+                                       initargs=(worker_infos,
+                                                 search_kwargs))
+        futures = [ executor.submit(_search_metag_in_worker, metag_filename)
+                    for metag_filename in against_list ]
+        metag_results = ( f.result() for f in futures )
+    else:
+        # load the next metagenome in the background while searching
+        # this one.
+        load_fn = partial(_load_metag, ksize=ksize, scaled=scaled,
+                          require_abundance=require_abundance,
+                          display_width=screen_width - 21)
+        metag_results = ( _search_all_queries(unique_infos, metag_ctxs,
+                                              want_ani=want_ani)
+                          for metag_ctxs in _map_prefetch(load_fn,
+                                                          against_list) )
+
+    try:
+        for results in metag_results:
+            # as before, report all sketches in a metagenome file for each
+            # query in turn.
+            results_by_md5 = dict(zip(unique_md5s, results))
+            for query_info in query_infos:
+                query_results = results_by_md5[query_info['md5']]
+                for has_abundance, results_d in query_results:
+                    if not has_abundance:
+                        missed_abundance = True
+
+                    results_d = results_d.copy()
+                    results_d['query_filename'] = query_info['filename']
+                    results_d['query_name'] = query_info['name']
+
                     name = results_d['display_name']
                     del results_d['display_name']
 
-                    has_abundance = results_d['average_abund'] != ''
-
                     # write out CSV
                     if out_w:
                         out_w.writerow(results_d)
@@ -394,21 +469,27 @@ def mg_many_search(query_filenames, against_list, *,
                         avg_abund = "N/A"
                         pct_metag = "N/A"
 
-                    query_name = query_ss._display_name(17)
+                    query_name = query_info['display_name']
                     if output_ani:
                         print(f'{query_name:<17} {display_ani:>6}%  {avg_abund:>6}     {pct_metag:>6}     {name}')
                     else:
                         print(f'{query_name:<17} {pct_genome:>6}%  {avg_abund:>6}     {pct_metag:>6}     {name}')
-
-            except MismatchScaled:
-                error(f"Unable to run comparison for '{query_ss.name}'; maybe set --scaled?")
-                return -1
-            # end each query genome
-        # end each subject metagenome
-
-    # close CSV file
-    if out_fp:
-        out_fp.close()
+                    # end each sketch
+                # end each query genome
+            # end each subject metagenome
+    except MismatchScaled as exc:
+        error(f"Unable to run comparison for '{exc}'; maybe set --scaled?")
+        return -1
+    finally:
+        if executor:
+            # on error, don't wait for metagenomes that haven't started.
+            for f in futures:
+                f.cancel()
+            executor.shutdown()
+
+        # close CSV file, even on error
+        if out_w:
+            out_w.close()
 
     # notify user that there were columns that were not filled in
     if missed_abundance:
@@ -416,100 +497,420 @@ def mg_many_search(query_filenames, against_list, *,
         notify("** Note: N/A in column values indicate metagenomes w/o abundance tracking.")
 
 
-def _search_metag(query_ss, metag_filename, *, ksize=None, scaled=None,
-                  require_abundance=None,
-                  screen_width=80, field_width=41):
+def _map_prefetch(fn, items):
     """
-    Do the actual search &c for query in a metagenome.
+    Like map(fn, items), but runs fn on the next item in a background
+    thread while the caller is working on the current result.
     """
-    query_mh = query_ss.minhash
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = None
+        for item in items:
+            next_future = executor.submit(fn, item)
+            if future is not None:
+                yield future.result()
+            future = next_future
 
-    metags = sourmash.load_file_as_signatures(metag_filename, ksize=ksize)
-    for metag in metags:
-        # check to make sure if metag needs & has abundance info
-        if require_abundance:
-            if not metag.minhash.track_abundance:
-                raise ValueError(f"sketch in '{metag_filename}' must have abundance information")
+        if future is not None:
+            yield future.result()
 
-        has_abundance = False
-        if metag.minhash.track_abundance:
-            has_abundance = True
-        else:
-            missed_abundance = True
 
-        if scaled and metag.minhash.scaled != scaled:
-            metag = metag.to_mutable()
-            metag.minhash = metag.minhash.downsample(scaled=scaled)
+# queries and search settings for this worker process; see _init_worker.
+_worker_state = None
 
-        # calculate stuff!
-        result = PrefetchResult(query_ss, metag, threshold_bp=0,
-                                 estimate_ani_ci=False)
 
-        # calculate total weighted hashes for use in denominator:
-        total_sum_abunds = metag.minhash.sum_abundances
-
-        # get a flattened copy for use in intersections...
-        flat_metag = metag.minhash.flatten()
-
-        # other info!
-        results_template = dict(match_md5=metag.md5sum(),
-                                match_name=metag.name,
-                                match_filename=metag_filename,
-                                ksize=ksize,
-                                moltype=metag.minhash.moltype,
-                                scaled=metag.minhash.scaled)
-
-        # this is where we depart from PrefetchResult :)
-        if has_abundance:
-            # now, get weighted containment for query genome
+def _init_worker(query_infos, search_kwargs):
+    """
+    Set up a worker process for parallel searches: store the queries and
+    search settings, and allocate each query's scratch buffer.
+    """
+    global _worker_state
+
+    for query_info in query_infos:
+        query_info['abund_buf'] = np.empty(len(query_info['hashes']),
+                                           dtype=np.int64)
+
+    _worker_state = (query_infos, search_kwargs)
+
+
+def _search_metag_in_worker(metag_filename):
+    """
+    Search a metagenome file with the queries stored by _init_worker.
+    """
+    query_infos, search_kwargs = _worker_state
+    return _search_metag(metag_filename, query_infos, **search_kwargs)
+
+
+def _search_metag(metag_filename, query_infos, *, ksize=None, scaled=None,
+                  require_abundance=None, display_width=59, want_ani=True):
+    """
+    Load the sketches in a metagenome file and search them with all
+    queries; see _search_all_queries for the results.
+    """
+    metag_ctxs = _load_metag(metag_filename, ksize=ksize, scaled=scaled,
+                             require_abundance=require_abundance,
+                             display_width=display_width)
+
+    return _search_all_queries(query_infos, metag_ctxs, want_ani=want_ani)
+
+
+def _search_all_queries(query_infos, metag_ctxs, *, want_ani=True):
+    """
+    Search the loaded sketches from a metagenome file with all queries.
+    Returns, for each query, a list of (has_abundance, results) pairs,
+    one per sketch.
+    """
+    results = []
+    for query_info in query_infos:
+        query_results = []
+        for metag_ctx in metag_ctxs:
             try:
-                intersect_mh = query_mh.intersection(flat_metag) # CTB: redundant?
-            except ValueError:
-                raise MismatchScaled
-
-            if len(intersect_mh):
-                w_intersect_mh = intersect_mh.inflate(metag.minhash)
-
-                abunds = list(w_intersect_mh.hashes.values())
-                mean = np.mean(abunds)
-                median = np.median(abunds)
-                std = np.std(abunds)
-                overlap_sum_abunds = w_intersect_mh.sum_abundances
-                f_sum_abunds = overlap_sum_abunds / total_sum_abunds
+                results_d = _score_query_against_metag(query_info, metag_ctx,
+                                                       want_ani=want_ani)
+            except MismatchScaled:
+                raise MismatchScaled(query_info['name'])
+            query_results.append((metag_ctx['has_abundance'], results_d))
+        results.append(query_results)
+
+    return results
+
+
+def _containment(n_common, mh):
+    """
+    Calculate debiased containment of 'mh' given the number of hashes it
+    shares with another sketch; matches MinHash.contained_by.
+    """
+    denom = len(mh)
+    if not denom:
+        return 0.0
+
+    total_denom = float(denom * mh.scaled)
+    bias_factor = 1.0 - (1.0 - 1.0 / mh.scaled) ** total_denom
+    containment = n_common / (denom * bias_factor)
+
+    # debiasing can lead to values outside of 0-1 range. constrain.
+    return min(max(containment, 0.0), 1.0)
+
+
+def _intersect_numpy(query_h, metag_h, metag_a, collected):
+    """
+    Intersect sorted query & metagenome hashes. Returns the number of
+    common hashes, along with the sum and array of the metagenome
+    abundances of the common hashes (if 'metag_a' is not empty).
+
+    'collected' is a scratch buffer with room for an abundance per query
+    hash; only the compiled kernel uses it, NumPy allocates its own.
+    """
+    idx = np.searchsorted(metag_h, query_h)
+    idx = np.minimum(idx, len(metag_h) - 1)
+    match_idx = idx[metag_h[idx] == query_h]
+    n_common = len(match_idx)
+
+    if not len(metag_a):
+        return n_common, 0, metag_a
+
+    abunds = metag_a[match_idx]
+    sum_abunds = int(abunds.sum())
+
+    return n_common, sum_abunds, abunds
+
+
+def _intersect_merge(query_h, metag_h, metag_a, collected):
+    """
+    Same as _intersect_numpy, but in a single pass that gallops through
+    the metagenome hashes, collecting abundances into the preallocated
+    'collected' buffer. Only used when compiled with numba.
+    """
+    n_query = len(query_h)
+    n_metag = len(metag_h)
+    has_abunds = len(metag_a) > 0
+
+    n_common = 0
+    sum_abunds = 0
+
+    j = 0
+    for i in range(n_query):
+        h = query_h[i]
+
+        # gallop forward to bracket h, then binary search.
+        step = 1
+        while j + step < n_metag and metag_h[j + step] < h:
+            step *= 2
+        lo = j
+        hi = min(j + step, n_metag - 1)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if metag_h[mid] < h:
+                lo = mid + 1
             else:
-                mean = 0
-                median = 0
-                std = 0
-                overlap_sum_abunds = 0
-                f_sum_abunds = 0.0
+                hi = mid
+        j = lo
+
+        if metag_h[j] == h:
+            if has_abunds:
+                a = metag_a[j]
+                collected[n_common] = a
+                sum_abunds += int(a)
+            n_common += 1
+        elif metag_h[j] < h:
+            # all remaining query hashes are past the end of metag_h.
+            break
+
+    if not has_abunds:
+        return n_common, sum_abunds, collected[:0]
+    return n_common, sum_abunds, collected[:n_common]
+
+
+if njit is not None:
+    _intersect = njit(cache=True)(_intersect_merge)
+else:
+    _intersect = _intersect_numpy
+
+
+def _abund_dtype(abunds):
+    """
+    Pick the smallest dtype that can hold all (non-negative) abundances.
+    """
+    amax = abunds.max() if len(abunds) else 0
+    if amax < 1 << 16:
+        return np.uint16
+    elif amax < 1 << 32:
+        return np.uint32
+    return np.int64
+
+
+def _abund_stats(abunds, sum_abunds):
+    """
+    Calculate mean, median, and std dev of a non-empty array of
+    abundances, given their sum.
+    """
+    n = len(abunds)
+    mean = sum_abunds / n
+
+    # population std dev; numpy's two-pass calculation is numerically
+    # stable, unlike the raw sum-of-squares formula.
+    std = abunds.std()
+
+    # partial sort for the middle element(s) only
+    mid = n // 2
+    if n % 2:
+        median = float(np.partition(abunds, mid)[mid])
+    else:
+        part = np.partition(abunds, (mid - 1, mid))
+        median = (int(part[mid - 1]) + int(part[mid])) / 2
+
+    return mean, median, std
+
+
+def _load_metag(metag_filename, *, ksize=None, scaled=None,
+                require_abundance=None, display_width=39, first_only=False):
+    """
+    Load the metagenome sketches in a file, along with everything needed
+    to search queries against them. Returns a list of context dicts, one
+    per sketch; with first_only, only the first sketch is prepared.
+    """
+    idx = sourmash.load_file_as_index(metag_filename)
+    idx = idx.select(ksize=ksize)
+
+    metags = idx.signatures()
+    if first_only:
+        metags = islice(metags, 1)
+
+    return [ _prepare_metag(metag, metag_filename, ksize=ksize,
+                            scaled=scaled,
+                            require_abundance=require_abundance,
+                            display_width=display_width)
+             for metag in metags ]
+
+
+def _prepare_metag(metag, metag_filename, *, ksize=None, scaled=None,
+                   require_abundance=None, display_width=39):
+    """
+    Build the context dict for searching queries against one metagenome
+    sketch.
+    """
+    # check to make sure if metag needs & has abundance info
+    if require_abundance:
+        if not metag.minhash.track_abundance:
+            raise ValueError(f"sketch in '{metag_filename}' must have abundance information")
+
+    has_abundance = False
+    if metag.minhash.track_abundance:
+        has_abundance = True
+
+    if scaled and metag.minhash.scaled != scaled:
+        metag = metag.to_mutable()
+        metag.minhash = metag.minhash.downsample(scaled=scaled)
+
+    metag_mh = metag.minhash
+
+    # extract sorted hashes & matching abundances, for vectorized
+    # intersections with each query.
+    metag_hashes = metag_mh.hashes
+    hashes = np.fromiter(metag_hashes.keys(), dtype=np.uint64,
+                         count=len(metag_hashes))
+    order = np.argsort(hashes)
+    hashes = hashes[order]
+
+    if has_abundance:
+        abunds = np.fromiter(metag_hashes.values(), dtype=np.int64,
+                             count=len(metag_hashes))
+        abunds = abunds[order]
+
+        # calculate total weighted hashes for use in denominator:
+        total_sum_abunds = int(abunds.sum())
+
+        # store abundances in the smallest dtype that fits, to cut down
+        # on memory traffic during intersections.
+        abunds = abunds.astype(_abund_dtype(abunds), copy=False)
+    else:
+        abunds = np.empty(0, dtype=np.int64)
+        total_sum_abunds = None
+
+    # other info! fill in the per-metagenome columns once.
+    results_template = _RESULTS_TEMPLATE.copy()
+    results_template['match_filename'] = metag_filename
+    results_template['match_name'] = metag.name
+    results_template['match_md5'] = metag.md5sum()
+    results_template['ksize'] = ksize
+    results_template['moltype'] = metag.minhash.moltype
+    results_template['scaled'] = metag.minhash.scaled
+    results_template['match_n_hashes'] = len(metag_mh)
+    results_template['match_n_weighted_hashes'] = total_sum_abunds
+    results_template['display_name'] = metag._display_name(display_width)
+
+    return dict(metag_mh=metag_mh,
+                hashes=hashes,
+                abunds=abunds,
+                has_abundance=has_abundance,
+                total_sum_abunds=total_sum_abunds,
+                results_template=results_template)
+
+
+def _get_query_info(query_ss, *, scaled=None):
+    """
+    Flatten & (if needed) downsample the query minhash, and collect the
+    query info needed for each search, so that it is only calculated once
+    per query. The signature itself is not copied. Raises ValueError if
+    the query cannot be downsampled to 'scaled'.
+    """
+    query_mh = query_ss.minhash
+
+    if query_mh.track_abundance:
+        notify(f"WARNING: query sketch '{query_ss.name}' has abundance; ignoring.")
+        query_mh = query_mh.flatten()
+
+    if scaled and scaled != query_mh.scaled:
+        query_mh = query_mh.downsample(scaled=scaled)
+
+    # md5sum is calculated once, on the sketch that will actually be
+    # searched.
+    md5 = sourmash.SourmashSignature(query_mh).md5sum()
+
+    # sorted hashes, for vectorized intersections with metagenomes.
+    hashes = np.fromiter(query_mh.hashes, dtype=np.uint64,
+                         count=len(query_mh))
+    hashes.sort()
+
+    # scratch space for the abundances of matching hashes; there can't be
+    # more of those than query hashes. Reused for every metagenome.
+    abund_buf = np.empty(len(hashes), dtype=np.int64)
+
+    return dict(query_mh=query_mh,
+                hashes=hashes,
+                abund_buf=abund_buf,
+                filename=query_ss.filename,
+                name=query_ss.name,
+                md5=md5,
+                n_hashes=len(query_mh),
+                display_name=query_ss._display_name(17))
+
+
+def _score_query_against_metag(query_info, metag_ctx, *, want_ani=True):
+    """
+    Do the actual search &c for query in a loaded metagenome.
+
+    If 'want_ani' is False, skip the ANI estimates and leave them empty.
+    """
+    query_mh = query_info['query_mh']
+    metag_mh = metag_ctx['metag_mh']
+    total_sum_abunds = metag_ctx['total_sum_abunds']
+
+    if not query_mh.is_compatible(metag_mh):
+        raise MismatchScaled
+
+    query_n_hashes = query_info['n_hashes']
+    match_n_hashes = len(metag_mh)
+
+    # intersect once, and calculate everything else from that. Empty
+    # sketches can't overlap, so skip the intersection for them.
+    if query_n_hashes and match_n_hashes:
+        n_common, overlap_sum_abunds, abunds = \
+            _intersect(query_info['hashes'], metag_ctx['hashes'],
+                       metag_ctx['abunds'], query_info['abund_buf'])
+        overlap_sum_abunds = int(overlap_sum_abunds)
+    else:
+        n_common = 0
+
+    # same containment & jaccard values as PrefetchResult
+    f_query = _containment(n_common, query_mh)
+    f_match = _containment(n_common, metag_mh)
+    union_size = query_n_hashes + match_n_hashes - n_common
+    jaccard = n_common / union_size if union_size else 0.0
+
+    # containment ANI in both directions
+    if want_ani:
+        query_ani = query_mh.containment_ani(metag_mh, containment=f_query)
+        match_ani = metag_mh.containment_ani(query_mh, containment=f_match)
+        query_containment_ani = query_ani.ani
+        match_containment_ani = match_ani.ani
+        if query_containment_ani is None or match_containment_ani is None:
+            average_containment_ani = max_containment_ani = None
+        else:
+            average_containment_ani = (query_containment_ani + match_containment_ani) / 2
+            max_containment_ani = max(query_containment_ani, match_containment_ani)
+        potential_false_negative = bool(query_ani.p_exceeds_threshold or
+                                        match_ani.p_exceeds_threshold)
+    else:
+        query_containment_ani = match_containment_ani = ""
+        average_containment_ani = max_containment_ani = ""
+        potential_false_negative = ""
+
+    # this is where we depart from PrefetchResult :)
+    if metag_ctx['has_abundance']:
+        # now, get weighted containment for query genome
+        if n_common:
+            mean, median, std = _abund_stats(abunds, overlap_sum_abunds)
+            f_sum_abunds = overlap_sum_abunds / total_sum_abunds
         else:
-            mean = median = std = ""
-            overlap_sum_abunds = ""
-            f_sum_abunds = ""
-
-        # calculate final results
-        results_d = dict(intersect_bp=result.intersect_bp,
-                         query_filename=query_ss.filename,
-                         query_name=query_ss.name,
-                         query_md5=query_ss.md5sum(),
-                         f_query=result.f_match_query,
-                         f_match=result.f_query_match,
-                         f_match_weighted=f_sum_abunds,
-                         sum_weighted_found=overlap_sum_abunds,
-                         query_n_hashes=len(query_mh),
-                         match_n_hashes=len(flat_metag),
-                         match_n_weighted_hashes=total_sum_abunds,
-                         average_abund=mean,
-                         median_abund=median,
-                         std_abund=std,
-                         jaccard=result.jaccard,
-                         genome_containment_ani=result.query_containment_ani,
-                         match_containment_ani=result.match_containment_ani,
-                         average_containment_ani=result.average_containment_ani,
-                         max_containment_ani=result.max_containment_ani,
-                         potential_false_negative=result.potential_false_negative,
-                         display_name=metag._display_name(screen_width - field_width)
-                         )
-
-        results_d.update(results_template)
-        yield results_d
+            mean = 0
+            median = 0
+            std = 0
+            overlap_sum_abunds = 0
+            f_sum_abunds = 0.0
+    else:
+        mean = median = std = ""
+        overlap_sum_abunds = ""
+        f_sum_abunds = ""
+
+    # calculate final results, starting from the per-metagenome template
+    results_d = metag_ctx['results_template'].copy()
+    results_d['intersect_bp'] = n_common * metag_mh.scaled
+    results_d['query_filename'] = query_info['filename']
+    results_d['query_name'] = query_info['name']
+    results_d['query_md5'] = query_info['md5']
+    results_d['f_query'] = f_query
+    results_d['f_match'] = f_match
+    results_d['f_match_weighted'] = f_sum_abunds
+    results_d['sum_weighted_found'] = overlap_sum_abunds
+    results_d['average_abund'] = mean
+    results_d['median_abund'] = median
+    results_d['std_abund'] = std
+    results_d['query_n_hashes'] = query_n_hashes
+    results_d['jaccard'] = jaccard
+    results_d['genome_containment_ani'] = query_containment_ani
+    results_d['match_containment_ani'] = match_containment_ani
+    results_d['average_containment_ani'] = average_containment_ani
+    results_d['max_containment_ani'] = max_containment_ani
+    results_d['potential_false_negative'] = potential_false_negative
+
+    return results_d
@@ -357,3 +357,338 @@ def test_manysearch_0_x_podar_scaled_change_against(runtmp):
 
     err = runtmp.last_result.err
     assert "Unable to run comparison for" in err
+
+
+def test_manysearch_many_x_many_out(runtmp):
+    # multiple queries x multiple metagenomes => one row per pair
+    query1 = utils.get_test_data('0.sig.zip')
+    query2 = utils.get_test_data('1.sig.zip')
+    against1 = utils.get_test_data('SRR606249.k31.sig.zip')
+    against2 = utils.get_test_data('0.sig.zip')
+
+    runtmp.sourmash('scripts', 'mgmanysearch', '--queries', query1, query2,
+                    '--against', against1, against2, '-o', 'out.csv')
+
+    csvfp = open(runtmp.output('out.csv'), newline='')
+    rows = list(csv.DictReader(csvfp))
+    assert len(rows) == 4
+
+    pairs = set([ (row['query_name'].split()[0], row['match_name'])
+                  for row in rows ])
+    assert len(pairs) == 4
+
+    for row in rows:
+        if row['match_name'] == 'SRR606249':
+            assert round(float(row['f_query']), 3) == 1.0
+            assert row['average_abund']
+        else:
+            assert not row['average_abund']
+
+
+def test_manysearch_0_x_podar_scaled_out(runtmp):
+    # queries should be downsampled before search
+    query = utils.get_test_data('0.sig.zip')
+    against = utils.get_test_data('SRR606249.k31.sig.zip')
+    runtmp.sourmash('scripts', 'mgmanysearch', '--query', query,
+                    '--against', against, '--scaled', '200000',
+                    '-o', 'out.csv')
+
+    csvfp = open(runtmp.output('out.csv'), newline='')
+    rows = list(csv.DictReader(csvfp))
+    assert len(rows) == 1
+    row = rows[0]
+
+    query_ss = list(sourmash.load_file_as_signatures(query))[0]
+    query_mh = query_ss.minhash.downsample(scaled=200_000)
+
+    assert row['scaled'] == '200000'
+    assert int(row['query_n_hashes']) == len(query_mh)
+    assert row['query_md5'] == sourmash.SourmashSignature(query_mh).md5sum()
+    assert row['query_md5'] != query_ss.md5sum()
+
+
+def test_manysearch_multiple_metag_sketches(runtmp):
+    # each sketch in a metagenome file is searched, with all sketches
+    # reported for each query in turn.
+    query0 = utils.get_test_data('0.sig.zip')
+    query1 = utils.get_test_data('1.sig.zip')
+    sig0 = utils.get_test_data('0.sig.zip')
+    sig1 = utils.get_test_data('1.sig.zip')
+
+    against = runtmp.output('both.sig.zip')
+    runtmp.sourmash('sig', 'cat', sig0, sig1, '-o', against)
+
+    runtmp.sourmash('scripts', 'mgmanysearch', '--query', query0, query1,
+                    '--against', against, '-o', 'out.csv')
+
+    csvfp = open(runtmp.output('out.csv'), newline='')
+    rows = list(csv.DictReader(csvfp))
+    assert len(rows) == 4
+
+    order = [ (row['query_name'].split()[0], row['match_name'].split()[0],
+               float(row['f_query'])) for row in rows ]
+    assert order == [('CP001472.1', 'CP001472.1', 1.0),
+                     ('CP001472.1', 'CP001941.1', 0.0),
+                     ('CP001941.1', 'CP001472.1', 0.0),
+                     ('CP001941.1', 'CP001941.1', 1.0)]
+
+
+def test_manysearch_cores(runtmp):
+    # parallel search should give the same results, in the same order
+    query1 = utils.get_test_data('0.sig.zip')
+    query2 = utils.get_test_data('1.sig.zip')
+    against1 = utils.get_test_data('SRR606249.k31.sig.zip')
+    against2 = utils.get_test_data('0.sig.zip')
+
+    runtmp.sourmash('scripts', 'mgmanysearch', '--queries', query1, query2,
+                    '--against', against1, against2, '-o', 'serial.csv')
+    runtmp.sourmash('scripts', 'mgmanysearch', '--queries', query1, query2,
+                    '--against', against1, against2, '-o', 'parallel.csv',
+                    '-c', '2')
+
+    with open(runtmp.output('serial.csv'), newline='') as fp:
+        serial_rows = list(csv.DictReader(fp))
+    with open(runtmp.output('parallel.csv'), newline='') as fp:
+        parallel_rows = list(csv.DictReader(fp))
+
+    assert len(serial_rows) == 4
+    assert serial_rows == parallel_rows
+
+
+def test_manysearch_cores_scaled_mismatch(runtmp):
+    # a scaled mismatch in a worker process is reported as an error
+    query = utils.get_test_data('0.sig.zip')
+    metag = utils.get_test_data('SRR606249.k31.sig.zip')
+    sig0 = utils.get_test_data('0.sig.zip')
+
+    runtmp.sourmash('sig', 'downsample', '--scaled', '200000', query,
+                    '-o', 'query.sig.zip')
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'mgmanysearch', '--query',
+                        'query.sig.zip', '--against', metag, sig0,
+                        '-c', '2')
+
+    err = runtmp.last_result.err
+    assert "Unable to run comparison for" in err
+
+
+def test_manysearch_ani_matches_prefetch(runtmp):
+    # with dense enough sketches the ANI columns are filled in, and agree
+    # with sourmash's own PrefetchResult.
+    import random
+    from sourmash.search import PrefetchResult
+    from sourmash.save_load import SaveSignaturesToLocation
+
+    rng = random.Random(42)
+    query_mh = sourmash.MinHash(n=0, ksize=31, scaled=1000)
+    metag_mh = sourmash.MinHash(n=0, ksize=31, scaled=1000,
+                                track_abundance=True)
+
+    shared = set()
+    while len(shared) < 4000:
+        shared.add(rng.randrange(1, query_mh._max_hash))
+    query_only = set()
+    while len(query_only) < 1000:
+        hashval = rng.randrange(1, query_mh._max_hash)
+        if hashval not in shared:
+            query_only.add(hashval)
+    metag_only = set()
+    while len(metag_only) < 16000:
+        hashval = rng.randrange(1, query_mh._max_hash)
+        if hashval not in shared and hashval not in query_only:
+            metag_only.add(hashval)
+
+    query_mh.add_many(shared | query_only)
+    metag_mh.set_abundances({ hashval: rng.randint(1, 20)
+                              for hashval in shared | metag_only })
+
+    query_ss = sourmash.SourmashSignature(query_mh, name='query')
+    metag_ss = sourmash.SourmashSignature(metag_mh, name='metag')
+    with SaveSignaturesToLocation(runtmp.output('query.sig.zip')) as save_sig:
+        save_sig.add(query_ss)
+    with SaveSignaturesToLocation(runtmp.output('metag.sig.zip')) as save_sig:
+        save_sig.add(metag_ss)
+
+    runtmp.sourmash('scripts', 'mgmanysearch', '--query', 'query.sig.zip',
+                    '--against', 'metag.sig.zip', '-o', 'out.csv')
+
+    csvfp = open(runtmp.output('out.csv'), newline='')
+    rows = list(csv.DictReader(csvfp))
+    assert len(rows) == 1
+    row = rows[0]
+
+    expected = PrefetchResult(query_ss, metag_ss, threshold_bp=0)
+    assert expected.query_containment_ani is not None
+    assert expected.match_containment_ani is not None
+
+    assert float(row['genome_containment_ani']) == pytest.approx(expected.query_containment_ani)
+    assert float(row['match_containment_ani']) == pytest.approx(expected.match_containment_ani)
+    assert float(row['average_containment_ani']) == pytest.approx(expected.average_containment_ani)
+    assert float(row['max_containment_ani']) == pytest.approx(expected.max_containment_ani)
+    assert row['potential_false_negative'] == str(expected.potential_false_negative)
+
+
+def test_manysearch_scaled_mismatch_keeps_output(runtmp):
+    # rows written before a scaled mismatch still end up in the CSV
+    query = utils.get_test_data('0.sig.zip')
+    sig0 = utils.get_test_data('0.sig.zip')
+    sig1 = utils.get_test_data('1.sig.zip')
+
+    runtmp.sourmash('sig', 'downsample', '--scaled', '200000', sig1,
+                    '-o', 'big.sig.zip')
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'mgmanysearch', '--query', query,
+                        '--against', sig0, 'big.sig.zip', '-o', 'out.csv')
+
+    err = runtmp.last_result.err
+    assert "Unable to run comparison for" in err
+
+    csvfp = open(runtmp.output('out.csv'), newline='')
+    rows = list(csv.DictReader(csvfp))
+    assert len(rows) == 1
+    assert rows[0]['match_name'].startswith('CP001472.1')
+
+
+def test_intersect_implementations():
+    # numpy, pure Python merge, and (possibly numba-compiled) _intersect
+    # should all agree.
+    import numpy as np
+    from sourmash_plugin_containment_search import (_intersect,
+                                                    _intersect_numpy,
+                                                    _intersect_merge)
+
+    rng = np.random.default_rng(42)
+    metag_h = np.unique(rng.integers(0, 2**63, 5000, dtype=np.uint64))
+    metag_a = rng.integers(1, 1000, len(metag_h), dtype=np.int64)
+    no_abunds = np.empty(0, dtype=np.int64)
+
+    query_h = np.unique(np.concatenate([rng.choice(metag_h, 300),
+                                        rng.integers(0, 2**63, 300,
+                                                     dtype=np.uint64)]))
+
+    for fn in (_intersect, _intersect_merge):
+        for q_h, m_a in ((query_h, metag_a),
+                         (query_h[:1], metag_a),
+                         (query_h[-1:], metag_a),
+                         (query_h, metag_a.astype(np.uint16)),
+                         (query_h, metag_a.astype(np.uint32))):
+            buf = np.empty(len(q_h), dtype=np.int64)
+            n, s, abunds = fn(q_h, metag_h, m_a, buf)
+            n2, s2, abunds2 = _intersect_numpy(q_h, metag_h, metag_a, buf)
+            assert n == n2
+            assert s == s2
+            assert list(abunds) == list(abunds2)
+
+            n, s, abunds = fn(q_h, metag_h, no_abunds, buf)
+            assert n == n2
+            assert len(abunds) == 0
+
+
+def test_results_writer_matches_csv(runtmp):
+    # _ResultsWriter output should be identical to csv.writer output
+    from sourmash_plugin_containment_search import _ResultsWriter, COLUMNS
+
+    values = ['a, b', 'say "hi"', 'line\nbreak', 'plain', '', None, 1, 2.5,
+              False, 'cr\rhere']
+    rows = []
+    for i in range(3):
+        rows.append(dict([ (col, values[(i + j) % len(values)])
+                           for j, col in enumerate(COLUMNS) ]))
+
+    out_w = _ResultsWriter(runtmp.output('fast.csv'))
+    for row in rows:
+        out_w.writerow(row)
+    out_w.close()
+
+    with open(runtmp.output('ref.csv'), 'w', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(COLUMNS)
+        for row in rows:
+            w.writerow([ row[col] for col in COLUMNS ])
+
+    with open(runtmp.output('fast.csv'), newline='') as fp:
+        fast = fp.read()
+    with open(runtmp.output('ref.csv'), newline='') as fp:
+        ref = fp.read()
+
+    assert fast == ref
+
+
+def test_manysearch_duplicate_queries(runtmp):
+    # identical query sketches are searched once, but reported for each
+    query = utils.get_test_data('0.sig.zip')
+    against = utils.get_test_data('SRR606249.k31.sig.zip')
+
+    renamed = runtmp.output('renamed.sig.zip')
+    runtmp.sourmash('sig', 'rename', query, 'renamed', '-o', renamed)
+
+    runtmp.sourmash('scripts', 'mgmanysearch', '--queries', query, renamed,
+                    '--against', against, '-o', 'out.csv')
+
+    err = runtmp.last_result.err
+    print(err)
+    assert "Searching with 1 distinct query sketches." in err
+
+    out = runtmp.last_result.out
+    print(out)
+    assert "CP001472.1 Aci...  100.0%    54.2       3.1%     SRR606249" in out
+    assert "renamed            100.0%    54.2       3.1%     SRR606249" in out
+
+    csvfp = open(runtmp.output('out.csv'), newline='')
+    rows = list(csv.DictReader(csvfp))
+    assert len(rows) == 2
+
+    assert rows[0]['query_name'].startswith('CP001472.1')
+    assert rows[1]['query_name'] == 'renamed'
+    assert rows[0]['query_md5'] == rows[1]['query_md5']
+    assert rows[0]['average_abund'] == rows[1]['average_abund']
+
+
+def test_abund_stats():
+    # mean, median & std dev should match numpy's, including for large
+    # abundances with little spread.
+    import numpy as np
+    from sourmash_plugin_containment_search import _abund_stats
+
+    rng = np.random.default_rng(1)
+    cases = [np.array([5], dtype=np.int64),
+             np.array([3, 8], dtype=np.int64),
+             rng.integers(1, 500, 101, dtype=np.int64),
+             rng.integers(1, 500, 100, dtype=np.int64),
+             rng.integers(1, 500, 100).astype(np.uint16),
+             10_000_000 + rng.integers(0, 3, 1001, dtype=np.int64),
+             10_000_000 + rng.integers(0, 3, 1000, dtype=np.int64)]
+
+    for abunds in cases:
+        mean, median, std = _abund_stats(abunds, int(abunds.sum()))
+        assert mean == pytest.approx(np.mean(abunds))
+        assert median == np.median(abunds)
+        assert std == pytest.approx(np.std(abunds))
+
+
+def test_worker_search_matches_serial():
+    # queries are sent to worker processes without their scratch buffers;
+    # searching in a worker should give the same results as directly.
+    import pickle
+    from sourmash_plugin_containment_search import (_get_query_info,
+                                                    _init_worker,
+                                                    _search_metag,
+                                                    _search_metag_in_worker)
+
+    query_ss = sourmash.load_file_as_signatures(utils.get_test_data('0.sig.zip'))
+    query_ss = list(query_ss)[0]
+    metag = utils.get_test_data('SRR606249.k31.sig.zip')
+
+    query_info = _get_query_info(query_ss, scaled=100000)
+    worker_info = { k: v for k, v in query_info.items() if k != 'abund_buf' }
+    worker_info = pickle.loads(pickle.dumps(worker_info))
+
+    search_kwargs = dict(ksize=31, scaled=100000, require_abundance=False,
+                         want_ani=True)
+    _init_worker([worker_info], search_kwargs)
+    assert len(worker_info['abund_buf']) == query_info['n_hashes']
+
+    expected = _search_metag(metag, [query_info], **search_kwargs)
+    assert _search_metag_in_worker(metag) == expected